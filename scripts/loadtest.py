@@ -0,0 +1,427 @@
+"""
+Load test of the service, without the Core Engine nor S3.
+
+The script starts local stand-ins for the engine (which receives the service's
+announcement and the task callbacks) and for an S3-compatible store, then starts
+the real FastAPI app with uvicorn once per `MAX_TASKS` value and drives its
+`/compute` route at a fixed concurrency with a mix of image sizes.
+
+For each `MAX_TASKS` value it reports the sustained throughput (the tasks
+completed during the measured duration, including those submitted during the
+warmup), the latency percentiles of the tasks submitted during it and the
+requests rejected with a 503 because the queue is full, and then the
+saturation point: the smallest `MAX_TASKS` reaching 95% of the best
+throughput. Any other error status aborts the run.
+
+From the root of the repository, in the service's environment:
+
+    python scripts/loadtest.py --max-tasks 1 2 4 8 --concurrency 16 --duration 60 \\
+        --sizes 800x600:2 1654x2339:1 2480x3508:1
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+import cv2
+import httpx
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UUID_PATTERN = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+S3_BUCKET = "engine"
+S3_REGION = "eu-central-2"
+
+# Statuses of a task callback after which the service no longer updates the task
+TERMINAL_STATUSES = ("finished", "error")
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _respond(self, status, body=b"", content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+
+class StandInEngine(object):
+    """
+    Accept every request of the service and resolve the pending tasks whose id
+    appears in the path or body of a callback with a terminal status
+    """
+
+    def __init__(self):
+        self.pending = {}
+        self._lock = threading.Lock()
+        engine = self
+
+        class Handler(_QuietHandler):
+            def _handle(self):
+                body = self._read_body()
+                engine._on_request(self.path, body)
+                self._respond(200, b"{}")
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", get_free_port()), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def expect(self, task_id, loop):
+        future = loop.create_future()
+        with self._lock:
+            self.pending[task_id] = (loop, future)
+        return future
+
+    def forget(self, task_id):
+        with self._lock:
+            self.pending.pop(task_id, None)
+
+    def _on_request(self, path, body):
+        # Only a callback with a terminal status completes a task, not the intermediate status updates
+        try:
+            payload = json.loads(body) if body else None
+        except ValueError:
+            return
+        status = str(payload.get("status", "")).lower() if isinstance(payload, dict) else ""
+        if status not in TERMINAL_STATUSES:
+            return
+        failed = status == "error"
+
+        text = path + " " + body.decode("utf8", errors="ignore")
+        for task_id in set(UUID_PATTERN.findall(text)):
+            with self._lock:
+                entry = self.pending.pop(task_id, None)
+            if entry is not None:
+                loop, future = entry
+                loop.call_soon_threadsafe(_set_result, future, (time.perf_counter(), failed))
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+class StandInS3(object):
+    """
+    In-memory S3-compatible store answering the object requests of the service,
+    with path-style or virtual-hosted-style addressing and without authentication
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self._lock = threading.Lock()
+        store = self
+
+        class Handler(_QuietHandler):
+            def _key(self):
+                path = unquote(urlparse(self.path).path).lstrip("/")
+                host = self.headers.get("Host", "")
+                if host.startswith(f"{S3_BUCKET}."):
+                    return path
+                return path.split("/", 1)[1] if "/" in path else ""
+
+            def do_PUT(self):
+                body = self._read_body()
+                with store._lock:
+                    store.objects[self._key()] = body
+                self._respond(200, headers={"ETag": f'"{uuid.uuid4().hex}"'})
+
+            def do_GET(self):
+                with store._lock:
+                    body = store.objects.get(self._key())
+                if body is None:
+                    self._respond(404, b"<Error><Code>NoSuchKey</Code></Error>", "application/xml")
+                else:
+                    self._respond(200, body, "application/octet-stream")
+
+            do_HEAD = do_GET
+
+            def do_DELETE(self):
+                with store._lock:
+                    store.objects.pop(self._key(), None)
+                self._respond(204)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", get_free_port()), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def put(self, key, body):
+        with self._lock:
+            self.objects[key] = body
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def parse_sizes(sizes):
+    # "WIDTHxHEIGHT:WEIGHT" entries
+    result = []
+    for size in sizes:
+        dimensions, _, weight = size.partition(":")
+        width, height = (int(value) for value in dimensions.lower().split("x"))
+        result.append((width, height, float(weight or 1)))
+    return result
+
+
+def prepare_images(s3, image_path, sizes):
+    """
+    Upload the image resized to each size, and return their keys and weights
+    """
+    img = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    keys, weights = [], []
+    for width, height, weight in sizes:
+        is_success, buffer = cv2.imencode(".jpg", cv2.resize(img, (width, height)))
+        key = f"loadtest-{width}x{height}.jpg"
+        s3.put(key, buffer.tobytes())
+        keys.append(key)
+        weights.append(weight)
+    return keys, weights
+
+
+def start_service(max_tasks, engine, port):
+    env = dict(
+        os.environ,
+        MAX_TASKS=str(max_tasks),
+        ENGINE_URLS=json.dumps([engine.url]),
+        SERVICE_URL=f"http://127.0.0.1:{port}",
+        ENGINE_ANNOUNCE_RETRIES="1",
+        LOG_LEVEL="warning",
+    )
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level",
+         "warning"],
+        cwd=os.path.join(ROOT_DIR, "src"),
+        env=env,
+    )
+
+
+async def wait_for_service(client, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/status")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError("The service did not start in time")
+
+
+def service_task(s3, task_id, key, callback_url):
+    return {
+        "s3_access_key_id": "loadtest",
+        "s3_secret_access_key": "loadtest",
+        "s3_region": S3_REGION,
+        "s3_host": s3.url,
+        "s3_bucket": S3_BUCKET,
+        "callback_url": callback_url,
+        "task": {
+            "data_in": [key],
+            "service_id": "00000000-0000-0000-0000-000000000000",
+            "pipeline_id": "00000000-0000-0000-0000-000000000000",
+            "id": task_id,
+        },
+    }
+
+
+async def drive(client, engine, s3, keys, weights, concurrency, warmup, duration, task_timeout):
+    """
+    Keep `concurrency` tasks in flight for the warmup and the measured duration
+
+    The throughput counts the tasks completed during the measured duration,
+    whenever they were submitted, and the latencies are those of the tasks
+    submitted during it, waited for even after its end.
+    """
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    measure_start = start + warmup
+    end = measure_start + duration
+    stats = {"completed": 0, "latencies": [], "rejected": 0, "failed": 0, "timeouts": 0}
+
+    async def worker():
+        while time.perf_counter() < end:
+            task_id = str(uuid.uuid4())
+            key = random.choices(keys, weights)[0]
+            future = engine.expect(task_id, loop)
+            submitted_at = time.perf_counter()
+            measured = submitted_at >= measure_start
+            response = await client.post(
+                "/compute", json=service_task(s3, task_id, key, f"{engine.url}/tasks/{task_id}")
+            )
+            if response.status_code == 503:
+                engine.forget(task_id)
+                if measured:
+                    stats["rejected"] += 1
+                # The queue is full, back off before retrying
+                await asyncio.sleep(0.05)
+                continue
+            if response.status_code != 200:
+                # Any other status is a broken setup, not load, and would skew the results
+                engine.forget(task_id)
+                raise RuntimeError(
+                    f"The service answered /compute with {response.status_code}: {response.text[:500]}"
+                )
+
+            try:
+                completed_at, failed = await asyncio.wait_for(future, task_timeout)
+            except asyncio.TimeoutError:
+                engine.forget(task_id)
+                if measured:
+                    stats["timeouts"] += 1
+                continue
+            if measure_start <= completed_at <= end:
+                if failed:
+                    stats["failed"] += 1
+                else:
+                    stats["completed"] += 1
+            if measured and not failed:
+                stats["latencies"].append(completed_at - submitted_at)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return stats
+
+
+def percentile(values, percent):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))]
+
+
+async def run_max_tasks(max_tasks, args, engine, s3, keys, weights):
+    port = get_free_port()
+    process = start_service(max_tasks, engine, port)
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}",
+            timeout=args.task_timeout,
+            limits=httpx.Limits(max_connections=args.concurrency),
+        ) as client:
+            await wait_for_service(client)
+            stats = await drive(
+                client, engine, s3, keys, weights, args.concurrency, args.warmup, args.duration, args.task_timeout
+            )
+    finally:
+        process.terminate()
+        process.wait()
+
+    latencies = stats["latencies"]
+    return {
+        "max_tasks": max_tasks,
+        "completed": stats["completed"],
+        "throughput": stats["completed"] / args.duration,
+        "p50": percentile(latencies, 50),
+        "p90": percentile(latencies, 90),
+        "p99": percentile(latencies, 99),
+        "mean": statistics.mean(latencies) if latencies else float("nan"),
+        "rejected": stats["rejected"],
+        "failed": stats["failed"],
+        "timeouts": stats["timeouts"],
+    }
+
+
+def saturation_point(results, ratio=0.95):
+    # None when no task completed, as there is then no throughput to saturate
+    best = max(result["throughput"] for result in results)
+    if best == 0:
+        return None
+    for result in sorted(results, key=lambda result: result["max_tasks"]):
+        if result["throughput"] >= ratio * best:
+            return result["max_tasks"]
+
+
+def print_report(results):
+    print(
+        f"{'MAX_TASKS':>9} {'tasks/s':>8} {'p50 (s)':>8} {'p90 (s)':>8} {'p99 (s)':>8} "
+        f"{'done':>6} {'rejected':>8} {'failed':>6} {'timeouts':>8}"
+    )
+    for result in results:
+        print(
+            f"{result['max_tasks']:>9} {result['throughput']:>8.2f} {result['p50']:>8.2f} {result['p90']:>8.2f} "
+            f"{result['p99']:>8.2f} {result['completed']:>6} {result['rejected']:>8} {result['failed']:>6} "
+            f"{result['timeouts']:>8}"
+        )
+    saturation = saturation_point(results)
+    if saturation is None:
+        print("Saturation point: none, no task completed during the measurements")
+    else:
+        print(f"Saturation point: MAX_TASKS={saturation} (95% of the best throughput)")
+
+
+async def main(args):
+    engine = StandInEngine()
+    s3 = StandInS3()
+    engine.start()
+    s3.start()
+    try:
+        keys, weights = prepare_images(s3, args.image, parse_sizes(args.sizes))
+        results = []
+        for max_tasks in args.max_tasks:
+            results.append(await run_max_tasks(max_tasks, args, engine, s3, keys, weights))
+    finally:
+        engine.stop()
+        s3.stop()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            json.dump({"results": results, "saturation_point": saturation_point(results)}, f, indent=4)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the service with local stand-ins for the engine and S3.")
+    parser.add_argument("--max-tasks", type=int, nargs="+", default=[1, 2, 4, 8], help="MAX_TASKS values to test")
+    parser.add_argument("--concurrency", type=int, default=16, help="Number of tasks kept in flight")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds measured per MAX_TASKS value")
+    parser.add_argument("--warmup", type=float, default=10, help="Seconds of load before measuring")
+    parser.add_argument("--task-timeout", type=float, default=300, help="Seconds to wait for a task callback")
+    parser.add_argument(
+        "--image", default=os.path.join(ROOT_DIR, "tests", "test.jpg"), help="Image resized to each size"
+    )
+    parser.add_argument(
+        "--sizes", nargs="+", default=["800x600:1", "1654x2339:1"], help="Image sizes as WIDTHxHEIGHT:WEIGHT"
+    )
+    parser.add_argument("--output", default=None, help="JSON file to write the results to")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
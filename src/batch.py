@@ -0,0 +1,200 @@
+"""
+Offline batch layout analysis, without the Core Engine, the tasks queue or S3.
+
+Run it from the `src` directory, like the service:
+
+    python batch.py /path/to/pages --output results.jsonl --images-dir annotated
+
+The input is either a directory, scanned recursively for images, or a manifest
+file listing one image path per line, relative paths being relative to the
+manifest. Each analysed page is appended to the JSONL output as soon as it is
+done, so an interrupted run resumes where it stopped when started again with
+the same output file. If a worker process dies, for instance killed when out of
+memory, the run stops with a non-zero exit code and can be resumed the same way.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+
+from paddleocr.ppocr.utils.logging import get_logger
+from utils import get_model_args
+from model.main_ import StructureSystem, main as main_model
+
+logger = get_logger()
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp")
+
+# Set in each worker process by `_init_worker`
+_structure_sys = None
+_model_args = None
+
+
+def list_input_files(input_path):
+    """
+    Return the images to analyse and the directory their paths are relative to
+    """
+    if os.path.isdir(input_path):
+        files = []
+        for dir_path, _, file_names in os.walk(input_path):
+            for file_name in file_names:
+                if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                    files.append(os.path.join(dir_path, file_name))
+        return sorted(files), input_path
+
+    manifest_dir = os.path.dirname(os.path.abspath(input_path))
+    with open(input_path, "r", encoding="utf8") as f:
+        files = [os.path.join(manifest_dir, line.strip()) for line in f if line.strip()]
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(file)) for file in files]) if files else ""
+    return files, root
+
+
+def load_completed_files(output_path):
+    # The output doubles as the checkpoint: every successful line is a completed file
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+
+    with open(output_path, "r", encoding="utf8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # Half-written last line of an interrupted run, removed by `truncate_partial_line`
+                continue
+            if "error" not in result:
+                completed.add(result["file"])
+    return completed
+
+
+def truncate_partial_line(output_path):
+    # Drop the half-written last line of an interrupted run, so the next results start on a new line
+    if not os.path.exists(output_path):
+        return
+
+    with open(output_path, "rb+") as f:
+        # Look for the last newline from the end, without reading the whole output
+        position = f.seek(0, os.SEEK_END)
+        while position > 0:
+            chunk_start = max(0, position - 4096)
+            f.seek(chunk_start)
+            newline = f.read(position - chunk_start).rfind(b"\n")
+            if newline != -1:
+                f.truncate(chunk_start + newline + 1)
+                return
+            position = chunk_start
+        f.truncate(0)
+
+
+def _init_worker(cpu_threads):
+    global _structure_sys, _model_args
+    _model_args = get_model_args(cpu_threads=cpu_threads)
+    _structure_sys = StructureSystem(_model_args)
+
+
+def _process_file(job):
+    file, image_path = job
+    try:
+        img = cv2.imread(file, cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError("The file cannot be read as an image")
+
+        res, draw_img = main_model(_model_args, img, _structure_sys)
+        if image_path is not None:
+            os.makedirs(os.path.dirname(image_path), exist_ok=True)
+            cv2.imwrite(image_path, draw_img)
+        return {"file": file, "regions": res}
+    except Exception as e:
+        return {"file": file, "error": str(e)}
+
+
+def run(input_path, output_path, images_dir=None, workers=None, cpu_threads=1):
+    """
+    Analyse the files not completed yet, return False if a worker process died
+    """
+    files, root = list_input_files(input_path)
+    truncate_partial_line(output_path)
+    completed = load_completed_files(output_path)
+    pending = [file for file in files if file not in completed]
+    logger.info(
+        "{} files found, {} already completed, {} to analyse".format(
+            len(files), len(files) - len(pending), len(pending)
+        )
+    )
+    if not pending:
+        return True
+
+    jobs = []
+    for file in pending:
+        image_path = None
+        if images_dir is not None:
+            image_path = os.path.join(images_dir, os.path.relpath(os.path.abspath(file), os.path.abspath(root)))
+        jobs.append((file, image_path))
+
+    workers = workers or os.cpu_count()
+    start = time.time()
+    count = 0
+    errors = 0
+    remaining_jobs = iter(jobs)
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(cpu_threads,)) as executor, \
+            open(output_path, "a", encoding="utf8") as output:
+        # Only keep a few jobs per worker submitted, not one future per file
+        running = {}
+        for job in itertools.islice(remaining_jobs, workers * 4):
+            running[executor.submit(_process_file, job)] = job[0]
+
+        try:
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    del running[future]
+                    for job in itertools.islice(remaining_jobs, 1):
+                        running[executor.submit(_process_file, job)] = job[0]
+
+                    count += 1
+                    output.write(json.dumps(result) + "\n")
+                    output.flush()
+                    if "error" in result:
+                        errors += 1
+                        logger.warning("Failed to analyse {}: {}".format(result["file"], result["error"]))
+                    if count % 100 == 0 or count == len(jobs):
+                        elapsed = time.time() - start
+                        logger.info(
+                            "{}/{} files analysed ({} errors), {:.2f} pages/s".format(
+                                count, len(jobs), errors, count / elapsed
+                            )
+                        )
+        except BrokenProcessPool:
+            # A worker was killed (out of memory, crash of the model...) while analysing one of these files
+            logger.error(
+                "A worker process died while analysing one of {}, run the batch again to resume".format(
+                    ", ".join(sorted(running.values()))
+                )
+            )
+            return False
+    return True
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Analyse the layout of a batch of images.")
+    parser.add_argument("input", help="Directory of images or manifest file with one image path per line")
+    parser.add_argument("--output", required=True, help="JSONL file the results are appended to")
+    parser.add_argument("--images-dir", default=None, help="Directory to write the annotated images to")
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Number of worker processes (default: number of CPUs)"
+    )
+    parser.add_argument("--cpu-threads", type=int, default=1, help="CPU math library threads per worker")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not run(args.input, args.output, args.images_dir, args.workers, args.cpu_threads):
+        sys.exit(1)
@@ -0,0 +1,60 @@
+import os
+import tempfile
+from functools import lru_cache
+from typing import Annotated
+from pydantic import Field, PositiveInt
+from pydantic_settings import BaseSettings
+
+
+class ModelSettings(BaseSettings):
+    """
+    Settings of the layout analysis model, read from the environment
+    """
+
+    # Number of layout predictors kept ready to serve concurrent tasks
+    layout_pool_size: int = 2
+
+    # Number of CPU math library threads used by each predictor
+    layout_cpu_threads: int = 4
+
+    # Whether to run the predictors with MKL-DNN (Paddle only applies `layout_cpu_threads` when enabled)
+    layout_enable_mkldnn: bool = True
+
+    # Whether to keep the aspect ratio of the pages instead of stretching them to 800x608
+    layout_keep_ratio: bool = False
+
+    # Sizes the long side of the pages is resized to when keeping their aspect ratio
+    layout_target_sizes: list[PositiveInt] = Field([320, 512, 800], min_length=1)
+
+    # Ratios of the short side to the long side of the padded shapes, per target size
+    # (the default 3 target sizes and 2 ratios make 9 shapes, within the 10 shapes cached by MKL-DNN)
+    layout_bucket_ratios: list[Annotated[float, Field(gt=0, le=1)]] = Field([0.75, 1.0], min_length=1)
+
+    # Maximum number of regions kept per class after the non-maximum suppression
+    layout_keep_top_k: int = 100
+
+    # Number of recent layouts kept to answer near-duplicate pages (0 disables the cache)
+    layout_cache_size: int = 0
+
+    # Maximum number of differing bits between the hashes of two pages considered near-duplicates
+    layout_cache_max_distance: int = 8
+
+    # Side of the grid the pages are downscaled to before hashing (hashes have `size * size` bits)
+    layout_cache_hash_size: int = 16
+
+    # Fraction of the tasks profiled (0 disables profiling unless armed through `/profiles/arm`)
+    profiling_sample_rate: float = 0.0
+
+    # Seconds between two stack samples of a profiled task
+    profiling_interval: float = 0.005
+
+    # Directory the profiles are written to
+    profiling_dir: str = os.path.join(tempfile.gettempdir(), "layout-analysis-profiles")
+
+    # Number of most recent profiles kept in `profiling_dir`
+    profiling_max_profiles: int = Field(100, ge=1)
+
+
+@lru_cache()
+def get_model_settings():
+    return ModelSettings()
@@ -1,8 +1,8 @@
 import asyncio
 import time
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import FileResponse, RedirectResponse
 from common_code.config import get_settings
 from common_code.http_client import HttpClient
 from common_code.logger.logger import get_logger, Logger
@@ -19,14 +19,25 @@ from common_code.common.models import FieldDescription, ExecutionUnitTag
 from contextlib import asynccontextmanager
 
 # Imports required by the service's model
-from utils import custom_parse_args, CustomEncoder
+from utils import get_model_args, CustomEncoder
+from config import get_model_settings
+from profiling import Profiler
 from common_code.tasks.service import get_extension
 import numpy as np
 import cv2
-from model.main_ import main as main_model
+from model.main_ import get_cached_layout, predict_layout, render_layout
+from model.pool import StructureSystemPool
+from model.similarity import LayoutSimilarityCache
 
 
 settings = get_settings()
+model_settings = get_model_settings()
+profiler = Profiler(
+    output_dir=model_settings.profiling_dir,
+    sample_rate=model_settings.profiling_sample_rate,
+    interval=model_settings.profiling_interval,
+    max_profiles=model_settings.profiling_max_profiles,
+)
 
 
 class MyService(Service):
@@ -36,6 +47,8 @@ class MyService(Service):
 
     # Any additional fields must be excluded for Pydantic to work
     _model: object
+    _args: object
+    _cache: object
     _logger: Logger
 
     def __init__(self):
@@ -74,44 +87,57 @@ class MyService(Service):
         )
         self._logger = get_logger(settings)
 
+        # Load the model once, with a predictor per task that can run concurrently
+        self._args = get_model_args()
+        self._model = StructureSystemPool(self._args, size=model_settings.layout_pool_size)
+
+        # Reuse the layout of near-duplicate pages (e.g. the same form with different filled-in fields)
+        self._cache = None
+        if model_settings.layout_cache_size > 0:
+            self._cache = LayoutSimilarityCache(
+                capacity=model_settings.layout_cache_size,
+                max_distance=model_settings.layout_cache_max_distance,
+                hash_size=model_settings.layout_cache_hash_size,
+            )
+
     def process(self, data):
         # NOTE that the data is a dictionary with the keys being the field names set in the data_in_fields
         # The objects in the data variable are always bytes. It is necessary to convert them to the desired type
         # before using them.
 
-        # Pass specific arguments directly
-        args = custom_parse_args(
-            vis_font_path="Fonts/arial.ttf",
-            use_gpu=False,
-            image_dir="img_dir",
-            layout_model_dir="model/inference/picodet_lcnet_x1_0_layout_infer",
-            layout_dict_path="model/dict/layout_publaynet_dict.txt",
-            output="../output",
-            table=False,
-            ocr=False,
-        )
-
-        # Extract the image bytes from data
-        image_bytes = data["image"].data  # Extract the raw bytes of the image
-        input_type = data["image"].type
-
-        # Decode the image from bytes
-        img_ = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), 1)
-
-        res, img = main_model(args, img_)
-        guessed_extension = get_extension(input_type)
-        is_success, out_buff = cv2.imencode(guessed_extension, img)
-        res = CustomEncoder().encode(res)
-
-        # NOTE that the result must be a dictionary with the keys being the field names set in the data_out_fields
-        return {
-            "result_text": TaskData(data=res, type=FieldDescriptionType.APPLICATION_JSON),
-
-            "result_img": TaskData(
-                data=out_buff.tobytes(),
-                type=input_type,
-            )
-        }
+        # Profile the task if it is sampled, or armed for any task or for this input
+        with profiler.profile(data["image"].data):
+            # Extract the image bytes from data
+            image_bytes = data["image"].data  # Extract the raw bytes of the image
+            input_type = data["image"].type
+
+            # Decode the image from bytes (`np.frombuffer` wraps the bytes without copying them)
+            img_ = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+
+            # Near-duplicate pages reuse a cached layout without waiting for a free predictor
+            res, cache_key = None, None
+            if self._cache is not None:
+                res, cache_key = get_cached_layout(self._cache, img_)
+            if res is None:
+                with self._model.acquire() as structure_sys:
+                    res = predict_layout(structure_sys, img_, self._cache, cache_key)
+            res, img = render_layout(self._args, img_, res)
+            guessed_extension = get_extension(input_type)
+            is_success, out_buff = cv2.imencode(guessed_extension, img)
+            res = CustomEncoder().encode(res)
+
+            # Release the decoded and annotated images before copying the encoded result
+            del img_, img
+
+            # NOTE that the result must be a dictionary with the keys being the field names set in the data_out_fields
+            return {
+                "result_text": TaskData(data=res, type=FieldDescriptionType.APPLICATION_JSON),
+
+                "result_img": TaskData(
+                    data=out_buff.tobytes(),
+                    type=input_type,
+                )
+            }
 
 
 service_service: ServiceService | None = None
@@ -171,12 +197,13 @@ Inputs:
 - Document Image: A single image-based document (JPEG, PNG).
 
 Outputs:
-- JSON File: A structured JSON file containing detected parts, including their bounding boxes (bboxes), types,
-and confidence scores. Example:
+- JSON File: A structured JSON file containing detected parts in reading order, including their bounding boxes
+(bboxes), types, confidence scores, position in the reading order and the `order` of the region containing them
+(`parent`, null if none). Example:
 ```json
     [
-      {"type": "text", "bbox": [12, 730, 410, 848], "score": 0.7757388353347778},
-      {"type": "table", "bbox": [15, 360, 405, 711], "score": 0.9503183960914612}
+      {"type": "table", "bbox": [15, 360, 405, 711], "score": 0.9503183960914612, "order": 0, "parent": null},
+      {"type": "text", "bbox": [12, 730, 410, 848], "score": 0.7757388353347778, "order": 1, "parent": null}
     ]
 ```
 - Annotated Image: The original document image with bounding boxes drawn around detected regions,
@@ -234,3 +261,26 @@ app.add_middleware(
 @app.get("/", include_in_schema=False)
 async def root():
     return RedirectResponse("/docs", status_code=301)
+
+
+@app.get("/profiles", tags=["Profiling"])
+async def list_profiles():
+    return profiler.list_profiles()
+
+
+@app.post("/profiles/arm", tags=["Profiling"])
+async def arm_profiling(
+    count: int = Query(1, ge=1, le=100),
+    sha256: str | None = Query(None, pattern="^[0-9a-fA-F]{64}$"),
+):
+    # Profile the next tasks, or only those whose input has this SHA-256 digest (e.g. a slow document)
+    profiler.arm(count, sha256)
+    return {"armed": profiler.armed, "armed_digests": profiler.armed_digests}
+
+
+@app.get("/profiles/{file_name}", tags=["Profiling"])
+async def get_profile(file_name: str):
+    path = profiler.get_profile_path(file_name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path)
@@ -0,0 +1,167 @@
+import threading
+
+import cv2
+import numpy as np
+
+from paddleocr.ppocr.data.imaug.operators import KeepKeys, NormalizeImage, ToCHWImage
+from paddleocr.ppocr.utils.logging import get_logger
+from paddleocr.ppstructure.layout.predict_layout import LayoutPredictor
+
+logger = get_logger()
+
+# Number of input shapes PaddleOCR lets MKL-DNN cache
+MKLDNN_CACHE_CAPACITY = 10
+
+
+def _round_up(size, stride):
+    return int(np.ceil(size / stride) * stride)
+
+
+def get_bucket_shapes(target_sizes, bucket_ratios, stride):
+    """
+    All the padded input shapes, as (h, w): for each target size, a portrait and a
+    landscape shape per ratio of the short side to the long side
+    """
+    shapes = set()
+    for target_size in target_sizes:
+        long_side = _round_up(target_size, stride)
+        for ratio in bucket_ratios:
+            short_side = _round_up(target_size * ratio, stride)
+            shapes.add((long_side, short_side))
+            shapes.add((short_side, long_side))
+    return sorted(shapes)
+
+
+def get_bucket(h, w, target_sizes, bucket_ratios, stride):
+    """
+    Return the shape the image is resized to, keeping its aspect ratio, and the
+    padded shape of its bucket, as ((resize_h, resize_w), (pad_h, pad_w))
+
+    The long side targets the smallest target size that fits it (or the largest
+    one), and the short side the smallest bucket ratio that fits it (or the
+    largest one, the image being then scaled down to fit).
+    """
+    long_side, short_side = max(h, w), min(h, w)
+    target_size = next((size for size in sorted(target_sizes) if size >= long_side), max(target_sizes))
+    aspect_ratio = short_side / long_side
+    bucket_ratio = next((ratio for ratio in sorted(bucket_ratios) if ratio >= aspect_ratio), max(bucket_ratios))
+    bucket_long, bucket_short = _round_up(target_size, stride), _round_up(target_size * bucket_ratio, stride)
+
+    scale = min(target_size / long_side, bucket_short / short_side)
+    resize_long = min(bucket_long, max(1, round(long_side * scale)))
+    resize_short = min(bucket_short, max(1, round(short_side * scale)))
+    if h >= w:
+        return (resize_long, resize_short), (bucket_long, bucket_short)
+    return (resize_short, resize_long), (bucket_short, bucket_long)
+
+
+class KeepRatioResize(object):
+    """
+    Resize the image to its bucket, keeping its aspect ratio, and record the padded
+    shape of the bucket for `PadToBucket`
+    """
+
+    def __init__(self, target_sizes, bucket_ratios, stride=32, **kwargs):
+        self.target_sizes = target_sizes
+        self.bucket_ratios = bucket_ratios
+        self.stride = stride
+
+    def __call__(self, data):
+        img = data["image"]
+        (resize_h, resize_w), data["pad_shape"] = get_bucket(
+            img.shape[0], img.shape[1], self.target_sizes, self.bucket_ratios, self.stride
+        )
+        data["image"] = cv2.resize(img, (resize_w, resize_h))
+        return data
+
+
+class PadToBucket(object):
+    """
+    Pad the bottom and right of a CHW image with zeros to the shape of its bucket
+    """
+
+    def __call__(self, data):
+        img = data["image"]
+        c, h, w = img.shape
+        pad_h, pad_w = data["pad_shape"]
+        padded_img = np.zeros((c, pad_h, pad_w), dtype=np.float32)
+        padded_img[:, :h, :w] = img
+        data["image"] = padded_img
+        return data
+
+
+class BucketLatencies(object):
+    """
+    Inference latencies grouped by input shape, shared by the clones of a predictor
+    """
+
+    def __init__(self):
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def add(self, bucket, elapse):
+        with self._lock:
+            count, total = self._latencies.get(bucket, (0, 0.0))
+            self._latencies[bucket] = (count + 1, total + elapse)
+            return count + 1, (total + elapse) / (count + 1)
+
+
+class KeepRatioLayoutPredictor(LayoutPredictor):
+    """
+    Layout predictor resizing the pages to one of a fixed set of shape buckets,
+    keeping their aspect ratio, instead of stretching every page to 800x608.
+
+    Small pages cost proportionally less compute, and the few input shapes stay
+    in the MKL-DNN cache.
+    """
+
+    def __init__(self, args, target_sizes, bucket_ratios, stride=32):
+        super().__init__(args)
+        self.target_sizes = target_sizes
+        self.bucket_ratios = bucket_ratios
+        self.stride = stride
+        self.bucket_latencies = BucketLatencies()
+        self.preprocess_op = [
+            KeepRatioResize(target_sizes, bucket_ratios, stride),
+            NormalizeImage(
+                std=[0.229, 0.224, 0.225],
+                mean=[0.485, 0.456, 0.406],
+                scale="1./255.",
+                order="hwc",
+            ),
+            ToCHWImage(),
+            PadToBucket(),
+            KeepKeys(keep_keys=["image"]),
+        ]
+
+        bucket_shapes = get_bucket_shapes(target_sizes, bucket_ratios, stride)
+        if args.enable_mkldnn and len(bucket_shapes) > MKLDNN_CACHE_CAPACITY:
+            logger.warning(
+                "{} layout buckets exceed the {} input shapes cached by MKL-DNN, "
+                "reduce the target sizes or bucket ratios".format(len(bucket_shapes), MKLDNN_CACHE_CAPACITY)
+            )
+
+    def __call__(self, img):
+        h, w = img.shape[:2]
+        (resize_h, resize_w), (pad_h, pad_w) = get_bucket(h, w, self.target_sizes, self.bucket_ratios, self.stride)
+
+        post_preds, elapse = super().__call__(img)
+        if post_preds is None:
+            return post_preds, elapse
+
+        # The post-processing scales the boxes back with the padded shape, not the resized one
+        ratio_w, ratio_h = pad_w / resize_w, pad_h / resize_h
+        for region in post_preds:
+            x1, y1, x2, y2 = region["bbox"]
+            region["bbox"] = np.array([
+                min(x1 * ratio_w, w),
+                min(y1 * ratio_h, h),
+                min(x2 * ratio_w, w),
+                min(y2 * ratio_h, h),
+            ])
+
+        count, mean = self.bucket_latencies.add((pad_w, pad_h), elapse)
+        logger.info(
+            "Layout bucket {}x{}: {:.3f}s (mean {:.3f}s over {} pages)".format(pad_w, pad_h, elapse, mean, count)
+        )
+        return post_preds, elapse
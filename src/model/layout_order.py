@@ -0,0 +1,208 @@
+"""
+Reading order and hierarchy of the layout regions.
+
+Containment is found with a static R-tree over the region boxes, and the
+reading order with a recursive XY-cut, so both stay fast on pages with
+hundreds of regions.
+"""
+
+
+def _area(box):
+    return max(0, box[2] - box[0]) * max(0, box[3] - box[1])
+
+
+def _intersection_area(box1, box2):
+    w = min(box1[2], box2[2]) - max(box1[0], box2[0])
+    h = min(box1[3], box2[3]) - max(box1[1], box2[1])
+    return w * h if w > 0 and h > 0 else 0
+
+
+def _intersects(box1, box2):
+    return box1[0] <= box2[2] and box2[0] <= box1[2] and box1[1] <= box2[3] and box2[1] <= box1[3]
+
+
+def _bounds(boxes):
+    return [
+        min(box[0] for box in boxes),
+        min(box[1] for box in boxes),
+        max(box[2] for box in boxes),
+        max(box[3] for box in boxes),
+    ]
+
+
+class BoxIndex(object):
+    """
+    Static R-tree over boxes, packed with the Sort-Tile-Recursive algorithm
+    """
+
+    def __init__(self, boxes, node_size=8):
+        self.boxes = boxes
+        self.node_size = node_size
+
+        # Each node is (bounds, children), the leaves' children are box indices
+        nodes = [(box, i) for i, box in enumerate(boxes)]
+        self._root = None
+        if not nodes:
+            return
+        nodes = self._pack(nodes)
+        while len(nodes) > 1:
+            nodes = self._pack(nodes)
+        self._root = nodes[0]
+
+    def _pack(self, nodes):
+        # Sort the nodes into vertical slices by center x, then each slice by center y
+        n_groups = -(-len(nodes) // self.node_size)
+        n_slices = max(1, round(n_groups ** 0.5))
+        slice_size = -(-len(nodes) // n_slices)
+
+        nodes = sorted(nodes, key=lambda node: node[0][0] + node[0][2])
+        packed = []
+        for i in range(0, len(nodes), slice_size):
+            vertical_slice = sorted(nodes[i:i + slice_size], key=lambda node: node[0][1] + node[0][3])
+            for j in range(0, len(vertical_slice), self.node_size):
+                children = vertical_slice[j:j + self.node_size]
+                packed.append((_bounds([child[0] for child in children]), children))
+        return packed
+
+    def query(self, box):
+        """
+        Return the indices of the boxes intersecting the box
+        """
+        result = []
+        if self._root is None:
+            return result
+
+        stack = [self._root]
+        while stack:
+            bounds, children = stack.pop()
+            if not _intersects(bounds, box):
+                continue
+            for child in children:
+                if isinstance(child[1], int):
+                    if _intersects(child[0], box):
+                        result.append(child[1])
+                else:
+                    stack.append(child)
+        return result
+
+
+def find_parents(boxes, min_containment=0.9):
+    """
+    Return, for each box, the index of the smallest larger box containing at
+    least `min_containment` of its area, or None
+    """
+    index = BoxIndex(boxes)
+    areas = [_area(box) for box in boxes]
+    parents = []
+    for i, box in enumerate(boxes):
+        parent = None
+        for j in index.query(box):
+            if j == i or areas[j] <= areas[i]:
+                continue
+            if areas[i] and _intersection_area(box, boxes[j]) >= min_containment * areas[i]:
+                if parent is None or areas[j] < areas[parent]:
+                    parent = j
+        parents.append(parent)
+    return parents
+
+
+def _split(indices, boxes, axis, tolerance):
+    # Group the boxes whose projections on the axis overlap
+    start, end = (0, 2) if axis == "x" else (1, 3)
+    indices = sorted(indices, key=lambda i: boxes[i][start])
+    groups = []
+    group_end = None
+    for i in indices:
+        if group_end is None or boxes[i][start] > group_end - tolerance:
+            groups.append([])
+            group_end = boxes[i][end]
+        else:
+            group_end = max(group_end, boxes[i][end])
+        groups[-1].append(i)
+    return groups
+
+
+def _fits_in_column(band, columns, boxes, tolerance):
+    # Whether the band lies within the x-extent of one of the columns
+    band_bounds = _bounds([boxes[i] for i in band])
+    for column in columns:
+        column_bounds = _bounds([boxes[i] for i in column])
+        if band_bounds[0] >= column_bounds[0] - tolerance and band_bounds[2] <= column_bounds[2] + tolerance:
+            return True
+    return False
+
+
+def _merge_bands(bands, boxes, tolerance):
+    # Merge consecutive bands sharing a column layout, so that each column is read to its end
+    merged = [bands[0]]
+    for band in bands[1:]:
+        if len(_split(band, boxes, "x", tolerance)) > 1:
+            merge = len(_split(merged[-1] + band, boxes, "x", tolerance)) > 1
+        else:
+            # A single column band, such as a paragraph taller than the one beside it, continues its column
+            columns = _split(merged[-1], boxes, "x", tolerance)
+            merge = len(columns) > 1 and _fits_in_column(band, columns, boxes, tolerance)
+        if merge:
+            merged[-1] = merged[-1] + band
+        else:
+            merged.append(band)
+    return merged
+
+
+def xy_cut(indices, boxes, tolerance=2):
+    """
+    Order the boxes by recursively cutting the page along the gaps between
+    them: left to right into columns, or else top to bottom into bands
+    """
+    if len(indices) <= 1:
+        return list(indices)
+
+    groups = _split(indices, boxes, "x", tolerance)
+    if len(groups) == 1:
+        groups = _split(indices, boxes, "y", tolerance)
+        if len(groups) > 1:
+            groups = _merge_bands(groups, boxes, tolerance)
+
+    if len(groups) > 1:
+        order = []
+        for group in groups:
+            order.extend(xy_cut(group, boxes, tolerance))
+        return order
+
+    # No gap left along any axis, fall back to top to bottom, left to right
+    return sorted(indices, key=lambda i: (boxes[i][1], boxes[i][0]))
+
+
+def order_regions(res):
+    """
+    Sort the regions in reading order and add to each one its `order` and the
+    `order` of its `parent` region (or None)
+
+    The regions contained in another one are read right after it.
+    """
+    boxes = [region["bbox"] for region in res]
+    parents = find_parents(boxes)
+
+    children = [[] for _ in res]
+    roots = []
+    for i, parent in enumerate(parents):
+        if parent is None:
+            roots.append(i)
+        else:
+            children[parent].append(i)
+
+    reading_order = []
+    stack = list(reversed(xy_cut(roots, boxes)))
+    while stack:
+        i = stack.pop()
+        reading_order.append(i)
+        stack.extend(reversed(xy_cut(children[i], boxes)))
+
+    orders = {i: order for order, i in enumerate(reading_order)}
+    ordered_res = []
+    for i in reading_order:
+        region = res[i]
+        region["order"] = orders[i]
+        region["parent"] = orders[parents[i]] if parents[i] is not None else None
+        ordered_res.append(region)
+    return ordered_res
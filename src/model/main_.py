@@ -1,20 +1,21 @@
 import os
 import sys
-import cv2
-import json
 import numpy as np
+import random
 import time
 import logging
-from copy import deepcopy
+from copy import copy
 
 
 from paddleocr.ppocr.utils.logging import get_logger
 from paddleocr.tools.infer.predict_system import TextSystem
 from paddleocr.ppstructure.layout.predict_layout import LayoutPredictor
-from paddleocr.ppstructure.utility import draw_structure_result, cal_ocr_word_box
-import tempfile
+from paddleocr.ppstructure.utility import cal_ocr_word_box
 
-from PIL import Image
+from PIL import Image, ImageDraw, ImageFont
+from profiling import section
+from model.keep_ratio import KeepRatioLayoutPredictor
+from model.layout_order import order_regions
 
 __dir__ = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(__dir__)
@@ -27,6 +28,7 @@ logger = get_logger()
 
 class StructureSystem(object):
     def __init__(self, args):
+        self.args = args
         self.mode = args.mode
         self.recovery = args.recovery
 
@@ -43,11 +45,31 @@ class StructureSystem(object):
             self.text_system = None
             self.formula_system = None
             if args.layout:
-                self.layout_predictor = LayoutPredictor(args)
+                if getattr(args, "layout_keep_ratio", False):
+                    self.layout_predictor = KeepRatioLayoutPredictor(
+                        args, args.layout_target_sizes, args.layout_bucket_ratios
+                    )
+                else:
+                    self.layout_predictor = LayoutPredictor(args)
+                if getattr(args, "layout_keep_top_k", None) is not None:
+                    self.layout_predictor.postprocess_op.keep_top_k = args.layout_keep_top_k
                 if args.ocr:
                     self.text_system = TextSystem(args)
         self.return_word_box = args.return_word_box
 
+    def clone(self):
+        """
+        Return a structure system sharing the model weights of this one,
+        which can run in another thread at the same time
+        """
+        structure_sys = copy(self)
+        if self.layout_predictor is not None:
+            structure_sys.layout_predictor = _clone_layout_predictor(self.layout_predictor)
+        if self.text_system is not None:
+            structure_sys.text_system = TextSystem(self.args)
+        return structure_sys
+
+    @section("StructureSystem.__call__")
     def __call__(self, img, return_ocr_result_in_table=False, img_idx=0):
         time_dict = {
             "layout": 0,
@@ -59,12 +81,11 @@ class StructureSystem(object):
         start = time.time()
 
         if self.mode == "structure":
-            ori_im = img.copy()
             if self.layout_predictor is not None:
                 layout_res, elapse = self.layout_predictor(img)
                 time_dict["layout"] += elapse
             else:
-                h, w = ori_im.shape[:2]
+                h, w = img.shape[:2]
                 layout_res = [dict(bbox=None, label="table", score=0.0)]
 
             text_res = None
@@ -79,10 +100,10 @@ class StructureSystem(object):
                 if region["bbox"] is not None:
                     x1, y1, x2, y2 = region["bbox"]
                     x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-                    roi_img = ori_im[y1:y2, x1:x2, :]
+                    roi_img = img[y1:y2, x1:x2, :]
                 else:
                     x1, y1, x2, y2 = 0, 0, w, h
-                    roi_img = ori_im
+                    roi_img = img
                 bbox = [x1, y1, x2, y2]
 
                 res_list.append(
@@ -172,89 +193,111 @@ class StructureSystem(object):
         return True
 
 
-def save_structure_res(res, save_folder, img_name, img_idx=0):
-    excel_save_folder = os.path.join(save_folder, img_name)
-    os.makedirs(excel_save_folder, exist_ok=True)
-    res_cp = deepcopy(res)
-    # save res
-    with open(
-            os.path.join(excel_save_folder, "res_{}.txt".format(img_idx)),
-            "w",
-            encoding="utf8",
-    ) as f:
-        for region in res_cp:
-            region.pop("img")
-            region.pop("res")
-            region.pop("img_idx")
-            f.write("{}\n".format(json.dumps(region)))
-
-
-def load_structure_res(output_folder, img_name, img_idx=0):
-    save_folder = os.path.join(output_folder, "structure")
-    # Construct the path to the .txt file
-    res_file_path = os.path.join(save_folder, img_name, f"res_{img_idx}.txt")
-
-    if not os.path.exists(res_file_path):
-        raise FileNotFoundError(f"The file {res_file_path} does not exist.")
-
-    # Read and load the content
-    results = []
-    with open(res_file_path, 'r', encoding='utf8') as f:
-        for line in f:
-            region = json.loads(line.strip())
-            results.append(region)
-
-    img_save_path = os.path.join(
-        save_folder, img_name, "show_{}.jpg".format(img_idx)
-    )
-
-    img = cv2.imread(img_save_path)
-
-    return results, img
-
+def _clone_layout_predictor(layout_predictor):
+    clone = copy(layout_predictor)
+    # ONNX Runtime sessions can be shared between threads, Paddle predictors must be cloned
+    if not layout_predictor.use_onnx:
+        predictor = layout_predictor.predictor.clone()
+        clone.predictor = predictor
+        clone.input_tensor = predictor.get_input_handle(predictor.get_input_names()[0])
+        clone.output_tensors = [
+            predictor.get_output_handle(name) for name in predictor.get_output_names()
+        ]
+    return clone
+
+
+def draw_layout_result(img, res, font_path):
+    """
+    Draw the layout regions on the image, without the OCR text panel that
+    `draw_structure_result` appends to its right
+    """
+    draw_img = Image.fromarray(img)
+    draw = ImageDraw.Draw(draw_img)
+    text_color = (255, 255, 255)
+    text_background_color = (80, 127, 255)
+    catid2color = {}
+    font = ImageFont.truetype(font_path, 15, encoding="utf-8")
+
+    for region in res:
+        if region["type"] not in catid2color:
+            catid2color[region["type"]] = (
+                random.randint(0, 255),
+                random.randint(0, 255),
+                random.randint(0, 255),
+            )
+        box_color = catid2color[region["type"]]
+        x1, y1, x2, y2 = region["bbox"]
+        draw.rectangle([(x1, y1), (x2, y2)], outline=box_color, width=3)
+
+        left, top, right, bottom = font.getbbox(region["type"])
+        draw.rectangle(
+            [(x1, y1), (x1 + right - left, y1 + bottom - top)],
+            fill=text_background_color,
+        )
+        draw.text((x1, y1), region["type"], fill=text_color, font=font)
 
-def main(args, img):
-    if not args.use_pdf2docx_api:
-        structure_sys = StructureSystem(args)
-        temp_dir = tempfile.TemporaryDirectory()
-        save_folder = os.path.join(temp_dir.name, structure_sys.mode)
-        os.makedirs(save_folder, exist_ok=True)
+    return np.asarray(draw_img)
 
-        img_name = "image"
-        index = 0
 
-        res, time_dict = structure_sys(img, img_idx=index)
-        img_save_path = os.path.join(
-            save_folder, img_name, "show_{}.jpg".format(index)
+def format_structure_res(res):
+    # Keep only the serializable fields of each region
+    return [
+        {
+            "type": region["type"],
+            "bbox": region["bbox"],
+            "score": float(region["score"]),
+            "order": region["order"],
+            "parent": region["parent"],
+        }
+        for region in res
+    ]
+
+
+def get_cached_layout(cache, img):
+    """
+    Return the cached layout of a near-duplicate page (or None) and the cache
+    key of the image, to store its layout once predicted
+    """
+    cache_key = cache.key(img)
+    res, distance = cache.get(cache_key, img)
+    logger.info(
+        "Layout cache {} (distance: {}, max distance: {}, hit rate: {:.1%})".format(
+            "miss" if res is None else "hit", distance, cache.max_distance, cache.hit_rate
         )
-        os.makedirs(os.path.join(save_folder, img_name), exist_ok=True)
-        if structure_sys.mode == "structure" and res != []:
-            draw_img = draw_structure_result(img, res, font_path=args.vis_font_path)
+    )
+    return res, cache_key
 
-            # Convert the NumPy array to a PIL image
-            if isinstance(draw_img, np.ndarray):
-                draw_img = Image.fromarray(draw_img)
 
-            # Get the dimensions of the composite image
-            width, height = draw_img.size
+def predict_layout(structure_sys, img, cache=None, cache_key=None):
+    res, time_dict = structure_sys(img)
+    logger.info("Predict time : {:.3f}s".format(time_dict["all"]))
+    if cache is not None and structure_sys.mode == "structure":
+        cache.put(cache_key, res)
+    return res
 
-            # Calculate the midpoint (to divide into two parts)
-            midpoint = width // 2
 
-            # Crop the left part (the annotated original image)
-            left_part = draw_img.crop((0, 0, midpoint, height))
+def render_layout(args, img, res):
+    """
+    Sort the regions in reading order and draw them on the image
+    """
+    res = order_regions(res)
 
-            # Convert the cropped image back to a NumPy array for further processing
-            left_part_np = np.array(left_part)
+    if args.mode == "structure" and res != []:
+        draw_img = draw_layout_result(img, res, font_path=args.vis_font_path)
+    else:
+        draw_img = img
+
+    return format_structure_res(res), draw_img
 
-            save_structure_res(res, save_folder, img_name, index)
-        if res != []:
-            cv2.imwrite(img_save_path, left_part_np)
-            logger.info("result save to {}".format(img_save_path))
-    logger.info("Predict time : {:.3f}s".format(time_dict["all"]))
 
-    res_, img_ = load_structure_res(temp_dir.name, img_name)
+def main(args, img, structure_sys=None, cache=None):
+    res, cache_key = None, None
+    if cache is not None:
+        res, cache_key = get_cached_layout(cache, img)
 
-    temp_dir.cleanup()
+    if res is None:
+        if structure_sys is None:
+            structure_sys = StructureSystem(args)
+        res = predict_layout(structure_sys, img, cache, cache_key)
 
-    return res_, img_
+    return render_layout(args, img, res)
@@ -0,0 +1,33 @@
+import queue
+from contextlib import contextmanager
+
+from model.main_ import StructureSystem
+
+
+class StructureSystemPool(object):
+    """
+    Pool of structure systems sharing the same model weights.
+
+    A structure system must not be called from several threads at once, so each
+    task checks one out of the pool for the duration of its inference.
+    """
+
+    def __init__(self, args, size=1):
+        if size < 1:
+            raise ValueError(f"The pool size must be at least 1, got {size}")
+
+        base = StructureSystem(args)
+        self.size = size
+        self._systems = queue.Queue(maxsize=size)
+        self._systems.put(base)
+        for _ in range(size - 1):
+            self._systems.put(base.clone())
+
+    @contextmanager
+    def acquire(self):
+        # Blocks until a structure system is returned to the pool
+        structure_sys = self._systems.get()
+        try:
+            yield structure_sys
+        finally:
+            self._systems.put(structure_sys)
@@ -0,0 +1,89 @@
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+def dhash(img, hash_size=16):
+    """
+    Difference hash of an image: compare each pixel of a downscaled
+    grayscale version of the image with its right neighbour
+    """
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(img, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    diff = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(diff).tobytes(), "big")
+
+
+def hamming_distance(hash1, hash2):
+    return (hash1 ^ hash2).bit_count()
+
+
+class LayoutSimilarityCache(object):
+    """
+    Cache of the layouts of recently analysed pages, looked up by perceptual hash.
+
+    A page whose hash is within `max_distance` bits of a cached page of the same
+    size reuses the cached layout instead of running the detection again.
+    """
+
+    def __init__(self, capacity, max_distance, hash_size=16):
+        self.capacity = capacity
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def key(self, img):
+        h, w = img.shape[:2]
+        return h, w, dhash(img, self.hash_size)
+
+    def get(self, key, img):
+        """
+        Return the cached layout closest to the key, with the regions cropped
+        from `img`, and its distance, or `(None, None)` when there is none
+        """
+        h, w, img_hash = key
+        with self._lock:
+            best_id, best_distance = None, None
+            for entry_id, (entry_key, _) in self._entries.items():
+                if entry_key[:2] != (h, w):
+                    continue
+                distance = hamming_distance(entry_key[2], img_hash)
+                if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                    best_id, best_distance = entry_id, distance
+
+            if best_id is None:
+                self.misses += 1
+                return None, None
+
+            self.hits += 1
+            self._entries.move_to_end(best_id)
+            regions = self._entries[best_id][1]
+
+        res = []
+        for region in regions:
+            x1, y1, x2, y2 = region["bbox"]
+            res.append(dict(region, img=img[y1:y2, x1:x2, :]))
+        return res, best_distance
+
+    def put(self, key, res):
+        # The crops belong to the analysed image, only the layout is kept
+        regions = [
+            {k: v for k, v in region.items() if k != "img"} for region in res
+        ]
+        with self._lock:
+            self._entries[self._next_id] = (key, regions)
+            self._next_id += 1
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
@@ -0,0 +1,261 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Profile of the task running in the current thread, if any
+_local = threading.local()
+
+# tracemalloc is process-wide, it is traced as long as one profiled task is running
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+def _start_tracemalloc(frames):
+    # Return whether the caller started the tracing, and so owns the peak
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        started = _tracemalloc_users == 0
+        if started:
+            tracemalloc.start(frames)
+            tracemalloc.reset_peak()
+        _tracemalloc_users += 1
+        return started
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+
+
+class _StackSampler(threading.Thread):
+    """
+    Sample the Python stack of another thread at a fixed interval
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class TaskProfile(object):
+    """
+    Stack samples, timed sections and allocation statistics of a single task
+    """
+
+    def __init__(self, name, interval, tracemalloc_frames, input_sha256=None):
+        self.name = name
+        self.input_sha256 = input_sha256
+        self.sections = {}
+        self._interval = interval
+        self._tracemalloc_frames = tracemalloc_frames
+        self._sampler = _StackSampler(threading.get_ident(), interval)
+
+    def start(self):
+        # Resetting the peak while another task is profiled would erase the peak it reached
+        self._peak_reliable = _start_tracemalloc(self._tracemalloc_frames)
+        self._started_at = time.time()
+        self._start = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self):
+        self._sampler.stop()
+        self.duration = time.perf_counter() - self._start
+        self._current_memory, self._peak_memory = tracemalloc.get_traced_memory()
+        self._snapshot = tracemalloc.take_snapshot()
+        _stop_tracemalloc()
+
+    def add_section(self, name, elapsed):
+        self.sections[name] = self.sections.get(name, 0) + elapsed
+
+    def save(self, output_dir, top_allocations=25):
+        # Stacks in the collapsed format read by flame graph tools
+        with open(os.path.join(output_dir, f"{self.name}.collapsed"), "w", encoding="utf8") as f:
+            for stack, count in self._sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        allocations = [
+            {
+                "location": str(stat.traceback),
+                "size": stat.size,
+                "count": stat.count,
+            }
+            for stat in self._snapshot.statistics("lineno")[:top_allocations]
+        ]
+        with open(os.path.join(output_dir, f"{self.name}.json"), "w", encoding="utf8") as f:
+            json.dump(
+                {
+                    "name": self.name,
+                    "input_sha256": self.input_sha256,
+                    "started_at": self._started_at,
+                    "duration": self.duration,
+                    "sections": self.sections,
+                    "sampling_interval": self._interval,
+                    "samples": sum(self._sampler.stacks.values()),
+                    # Process-wide, they include the allocations of concurrent tasks
+                    "memory": {
+                        "current": self._current_memory,
+                        "peak": self._peak_memory,
+                        # False when the task started while another one was profiled, the peak
+                        # may then have been reached before the task started
+                        "peak_reliable": self._peak_reliable,
+                        "top_allocations": allocations,
+                    },
+                },
+                f,
+                indent=4,
+            )
+
+
+class Profiler(object):
+    """
+    Opt-in profiling of tasks, either sampled at a fixed rate or armed for the next
+    tasks, optionally only those whose input has a given SHA-256 digest.
+
+    Each profiled task produces a `<name>.collapsed` file with its stack samples and
+    a `<name>.json` file with its timed sections and allocation statistics.
+    """
+
+    def __init__(self, output_dir, sample_rate=0.0, interval=0.005, max_profiles=100, tracemalloc_frames=10):
+        if max_profiles < 1:
+            raise ValueError(f"At least one profile must be kept, got {max_profiles}")
+
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_profiles = max_profiles
+        self.tracemalloc_frames = tracemalloc_frames
+        self.armed = 0
+        self.armed_digests = {}
+        self._lock = threading.Lock()
+
+    def arm(self, count=1, sha256=None):
+        """
+        Profile the next `count` tasks regardless of the sample rate, or only the
+        next `count` tasks whose input has the SHA-256 digest `sha256`
+        """
+        if count < 1:
+            raise ValueError(f"The number of tasks to profile must be at least 1, got {count}")
+
+        with self._lock:
+            if sha256 is None:
+                self.armed += count
+            else:
+                sha256 = sha256.lower()
+                self.armed_digests[sha256] = self.armed_digests.get(sha256, 0) + count
+
+    def _should_profile(self, data):
+        # Only hash the inputs while a digest is armed
+        digest = None
+        if self.armed_digests and data is not None:
+            digest = hashlib.sha256(data).hexdigest()
+
+        with self._lock:
+            if digest is not None:
+                if digest in self.armed_digests:
+                    self.armed_digests[digest] -= 1
+                    if self.armed_digests[digest] == 0:
+                        del self.armed_digests[digest]
+                    return True, digest
+            if self.armed > 0:
+                self.armed -= 1
+                return True, None
+        return random.random() < self.sample_rate, None
+
+    @contextmanager
+    def profile(self, data=None):
+        """
+        Profile the block if it is sampled or armed, `data` is the task input
+        matched against the armed digests
+        """
+        should_profile, digest = self._should_profile(data)
+        if not should_profile:
+            yield None
+            return
+
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        profile = TaskProfile(name, self.interval, self.tracemalloc_frames, digest)
+        profile.start()
+        _local.profile = profile
+        try:
+            yield profile
+        finally:
+            _local.profile = None
+            profile.stop()
+            # A failure to write the profile must not fail the task nor hide its exception
+            try:
+                os.makedirs(self.output_dir, exist_ok=True)
+                profile.save(self.output_dir)
+                logger.info(f"Saved the profile {name} (input SHA-256: {digest})")
+                self._remove_old_profiles()
+            except OSError as e:
+                logger.warning(f"Failed to save the profile {name}: {e}")
+
+    def list_profiles(self):
+        if not os.path.isdir(self.output_dir):
+            return []
+        return sorted(os.listdir(self.output_dir))
+
+    def get_profile_path(self, file_name):
+        # Only serve the files listed in the output directory
+        if file_name not in self.list_profiles():
+            return None
+        return os.path.join(self.output_dir, file_name)
+
+    def _remove_old_profiles(self):
+        with self._lock:
+            paths = [os.path.join(self.output_dir, file_name) for file_name in self.list_profiles()]
+            paths.sort(key=os.path.getmtime)
+            names = list(dict.fromkeys(os.path.splitext(path)[0] for path in paths))
+            for name in names[:len(names) - self.max_profiles]:
+                for extension in (".collapsed", ".json"):
+                    if os.path.exists(name + extension):
+                        os.remove(name + extension)
+
+
+@contextmanager
+def section(name):
+    """
+    Time a block (or, used as a decorator, a function) in the profile of the current task
+    """
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_section(name, time.perf_counter() - start)
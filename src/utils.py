@@ -1,6 +1,7 @@
 from json import JSONEncoder
 import json
 from paddleocr.ppstructure.utility import parse_args
+from config import get_model_settings
 
 
 def custom_parse_args(**kwargs):
@@ -16,6 +17,33 @@ def custom_parse_args(**kwargs):
     return args
 
 
+def get_model_args(**kwargs):
+    # Arguments shared by every entry point running the layout model
+    model_settings = get_model_settings()
+    model_args = dict(
+        vis_font_path="Fonts/arial.ttf",
+        use_gpu=False,
+        image_dir="img_dir",
+        layout_model_dir="model/inference/picodet_lcnet_x1_0_layout_infer",
+        layout_dict_path="model/dict/layout_publaynet_dict.txt",
+        output="../output",
+        table=False,
+        ocr=False,
+        enable_mkldnn=model_settings.layout_enable_mkldnn,
+        cpu_threads=model_settings.layout_cpu_threads,
+    )
+    model_args.update(kwargs)
+
+    args = custom_parse_args(**model_args)
+
+    # Options of this service that PaddleOCR's parser does not know
+    args.layout_keep_ratio = model_settings.layout_keep_ratio
+    args.layout_target_sizes = model_settings.layout_target_sizes
+    args.layout_bucket_ratios = model_settings.layout_bucket_ratios
+    args.layout_keep_top_k = model_settings.layout_keep_top_k
+    return args
+
+
 class CustomEncoder(JSONEncoder):
     def default(self, o):
         return json.dumps(
@@ -0,0 +1,89 @@
+import json
+import os
+import batch
+from batch import list_input_files, load_completed_files
+
+
+def test_list_input_files(tmp_path):
+    (tmp_path / "scans").mkdir()
+    (tmp_path / "scans" / "page_2.png").write_bytes(b"")
+    (tmp_path / "page_1.jpg").write_bytes(b"")
+    (tmp_path / "notes.txt").write_text("")
+
+    files, root = list_input_files(str(tmp_path))
+    assert files == [str(tmp_path / "page_1.jpg"), str(tmp_path / "scans" / "page_2.png")]
+    assert root == str(tmp_path)
+
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text(f"{tmp_path / 'scans' / 'page_2.png'}\n\n")
+    files, root = list_input_files(str(manifest))
+    assert files == [str(tmp_path / "scans" / "page_2.png")]
+    assert root == str(tmp_path / "scans")
+
+    # Relative paths are relative to the manifest, not to the working directory
+    manifest.write_text("scans/page_2.png\npage_1.jpg\n")
+    files, root = list_input_files(str(manifest))
+    assert files == [str(tmp_path / "scans" / "page_2.png"), str(tmp_path / "page_1.jpg")]
+    assert root == str(tmp_path)
+
+
+def test_load_completed_files(tmp_path):
+    output = tmp_path / "results.jsonl"
+    assert load_completed_files(str(output)) == set()
+
+    output.write_text(
+        json.dumps({"file": "a.jpg", "regions": []}) + "\n"
+        + json.dumps({"file": "b.jpg", "error": "The file cannot be read as an image"}) + "\n"
+        + '{"file": "c.jpg", "reg'
+    )
+    assert load_completed_files(str(output)) == {"a.jpg"}
+
+
+def fake_process_file(job):
+    file, image_path = job
+    return {"file": file, "regions": []}
+
+
+def test_resume(tmp_path, monkeypatch):
+    # The model is replaced, only the checkpointing of the output is tested
+    monkeypatch.setattr(batch, "_init_worker", lambda cpu_threads: None)
+    monkeypatch.setattr(batch, "_process_file", fake_process_file)
+    for name in ("a.jpg", "b.jpg", "c.jpg"):
+        (tmp_path / name).write_bytes(b"")
+    output = tmp_path / "results.jsonl"
+    output.write_text(
+        json.dumps({"file": str(tmp_path / "a.jpg"), "regions": []}) + "\n"
+        + json.dumps({"file": str(tmp_path / "b.jpg"), "regions": []})[:20]
+    )
+
+    assert batch.run(str(tmp_path), str(output), workers=1)
+
+    results = [json.loads(line) for line in output.read_text().splitlines()]
+    assert sorted(result["file"] for result in results) == [
+        str(tmp_path / "a.jpg"), str(tmp_path / "b.jpg"), str(tmp_path / "c.jpg")
+    ]
+
+    # Nothing left to analyse
+    assert batch.run(str(tmp_path), str(output), workers=1)
+    assert len(output.read_text().splitlines()) == 3
+
+
+def crashing_process_file(job):
+    file, image_path = job
+    if file.endswith("b.jpg"):
+        # Like a worker killed when out of memory, no exception reaches the pool
+        os._exit(1)
+    return {"file": file, "regions": []}
+
+
+def test_worker_crash(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, "_init_worker", lambda cpu_threads: None)
+    monkeypatch.setattr(batch, "_process_file", crashing_process_file)
+    for name in ("a.jpg", "b.jpg", "c.jpg"):
+        (tmp_path / name).write_bytes(b"")
+    output = tmp_path / "results.jsonl"
+
+    # The run stops instead of waiting forever for the dead worker
+    assert not batch.run(str(tmp_path), str(output), workers=1)
+    for line in output.read_text().splitlines():
+        assert json.loads(line)["file"] != str(tmp_path / "b.jpg")
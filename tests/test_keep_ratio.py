@@ -0,0 +1,41 @@
+import random
+import numpy as np
+from model.keep_ratio import PadToBucket, get_bucket, get_bucket_shapes
+
+target_sizes = [320, 512, 800]
+bucket_ratios = [0.75, 1.0]
+
+
+def test_bucket():
+    # A4 portrait page larger than every target size
+    assert get_bucket(3508, 2480, target_sizes, bucket_ratios, 32) == ((800, 566), (800, 608))
+    # Landscape slide
+    assert get_bucket(1080, 1920, target_sizes, bucket_ratios, 32) == ((450, 800), (608, 800))
+    # Square page
+    assert get_bucket(1000, 1000, target_sizes, bucket_ratios, 32) == ((800, 800), (800, 800))
+    # Thumbnails use the smallest target size that fits them
+    assert get_bucket(300, 200, target_sizes, bucket_ratios, 32) == ((320, 213), (320, 256))
+    # Squarer than the largest ratio: scaled down so the short side fits the bucket
+    assert get_bucket(1000, 990, [800], [0.75], 32) == ((614, 608), (800, 608))
+
+
+def test_bucket_shapes_are_fixed():
+    shapes = get_bucket_shapes(target_sizes, bucket_ratios, 32)
+    assert len(shapes) == 9
+
+    random.seed(0)
+    for _ in range(1000):
+        h, w = random.randint(10, 5000), random.randint(10, 5000)
+        (resize_h, resize_w), pad_shape = get_bucket(h, w, target_sizes, bucket_ratios, 32)
+        assert pad_shape in shapes
+        assert resize_h <= pad_shape[0] and resize_w <= pad_shape[1]
+        # The aspect ratio is kept, up to rounding
+        assert abs(resize_h / resize_w - h / w) <= h / w * 2 / min(resize_h, resize_w) + 1e-9
+
+
+def test_pad_to_bucket():
+    img = np.ones((3, 450, 800), dtype=np.float32)
+    data = PadToBucket()({"image": img, "pad_shape": (608, 800)})
+    assert data["image"].shape == (3, 608, 800)
+    assert data["image"][:, :450, :].sum() == img.sum()
+    assert data["image"][:, 450:, :].sum() == 0
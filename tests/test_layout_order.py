@@ -0,0 +1,90 @@
+import random
+from model.layout_order import BoxIndex, find_parents, order_regions
+
+
+def make_region(region_type, bbox):
+    return {"type": region_type, "bbox": bbox, "score": 0.9}
+
+
+def test_box_index():
+    random.seed(0)
+    boxes = []
+    for _ in range(500):
+        x, y = random.randint(0, 1000), random.randint(0, 1000)
+        boxes.append([x, y, x + random.randint(1, 100), y + random.randint(1, 100)])
+    index = BoxIndex(boxes)
+
+    query = [200, 300, 400, 450]
+    expected = [
+        i for i, box in enumerate(boxes)
+        if box[0] <= query[2] and query[0] <= box[2] and box[1] <= query[3] and query[1] <= box[3]
+    ]
+    assert sorted(index.query(query)) == expected
+    assert BoxIndex([]).query(query) == []
+
+
+def test_find_parents():
+    boxes = [
+        [0, 0, 500, 500],
+        [10, 10, 200, 200],
+        [20, 20, 100, 100],
+        [450, 450, 600, 600],
+    ]
+    # The smallest box containing each box is its parent, partial overlaps are not
+    assert find_parents(boxes) == [None, 0, 1, None]
+
+
+def test_order_regions_two_columns():
+    res = [
+        make_region("text", [320, 100, 600, 400]),
+        make_region("figure", [10, 420, 300, 700]),
+        make_region("title", [10, 10, 600, 60]),
+        make_region("text", [10, 100, 300, 400]),
+        make_region("list", [320, 420, 600, 700]),
+        make_region("text", [20, 600, 290, 690]),
+    ]
+
+    ordered = order_regions(res)
+
+    assert [region["type"] for region in ordered] == ["title", "text", "figure", "text", "text", "list"]
+    assert [region["bbox"][:2] for region in ordered] == [
+        [10, 10], [10, 100], [10, 420], [20, 600], [320, 100], [320, 420]
+    ]
+    assert [region["order"] for region in ordered] == list(range(6))
+    assert [region["parent"] for region in ordered] == [None, None, None, 2, None, None]
+
+
+def test_order_regions_two_columns_uneven_paragraphs():
+    res = [
+        make_region("title", [10, 10, 600, 60]),
+        make_region("text", [10, 100, 300, 200]),
+        make_region("text", [320, 100, 600, 190]),
+        make_region("text", [10, 210, 300, 300]),
+        make_region("text", [10, 310, 300, 500]),
+        make_region("text", [320, 320, 600, 500]),
+    ]
+
+    ordered = order_regions(res)
+
+    # The left paragraph between the gaps of the right column does not start a new band
+    assert [region["bbox"] for region in ordered] == [
+        [10, 10, 600, 60], [10, 100, 300, 200], [10, 210, 300, 300], [10, 310, 300, 500],
+        [320, 100, 600, 190], [320, 320, 600, 500],
+    ]
+
+
+def test_order_regions_full_width_figure():
+    res = [
+        make_region("text", [10, 10, 300, 200]),
+        make_region("text", [320, 10, 600, 200]),
+        make_region("figure", [10, 220, 600, 400]),
+        make_region("text", [10, 420, 300, 600]),
+        make_region("text", [320, 420, 600, 600]),
+    ]
+
+    ordered = order_regions(res)
+
+    # The figure spanning both columns separates the page into two bands
+    assert [region["bbox"][:2] for region in ordered] == [
+        [10, 10], [320, 10], [10, 220], [10, 420], [320, 420]
+    ]
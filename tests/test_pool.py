@@ -0,0 +1,63 @@
+import threading
+import pytest
+import model.pool
+from model.pool import StructureSystemPool
+
+
+class FakeStructureSystem(object):
+    def __init__(self, args):
+        self.args = args
+
+    def clone(self):
+        return FakeStructureSystem(self.args)
+
+
+def acquire_in_thread(pool, acquired):
+    # Acquire from another thread, so that a test fails instead of blocking forever
+    def acquire():
+        with pool.acquire() as structure_sys:
+            acquired.append(structure_sys)
+
+    thread = threading.Thread(target=acquire, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_pool_size(monkeypatch):
+    monkeypatch.setattr(model.pool, "StructureSystem", FakeStructureSystem)
+
+    with pytest.raises(ValueError):
+        StructureSystemPool(None, size=0)
+
+    pool = StructureSystemPool(None, size=3)
+    with pool.acquire() as first, pool.acquire() as second, pool.acquire() as third:
+        assert len({id(first), id(second), id(third)}) == 3
+
+
+def test_pool_acquire_blocks(monkeypatch):
+    monkeypatch.setattr(model.pool, "StructureSystem", FakeStructureSystem)
+    pool = StructureSystemPool(None, size=1)
+    acquired = []
+
+    with pool.acquire() as structure_sys:
+        thread = acquire_in_thread(pool, acquired)
+        thread.join(0.1)
+        # The only system is checked out, the thread waits for it
+        assert thread.is_alive() and acquired == []
+
+    thread.join(1)
+    assert acquired == [structure_sys]
+
+
+def test_pool_release_on_error(monkeypatch):
+    monkeypatch.setattr(model.pool, "StructureSystem", FakeStructureSystem)
+    pool = StructureSystemPool(None, size=1)
+
+    with pytest.raises(RuntimeError):
+        with pool.acquire() as structure_sys:
+            raise RuntimeError("inference error")
+
+    # The system went back to the pool
+    acquired = []
+    acquire_in_thread(pool, acquired).join(1)
+    assert acquired == [structure_sys]
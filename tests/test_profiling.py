@@ -0,0 +1,113 @@
+import hashlib
+import json
+import time
+import pytest
+from profiling import Profiler, section
+
+
+@section("slow_function")
+def slow_function():
+    data = [bytearray(1024) for _ in range(100)]
+    time.sleep(0.05)
+    return data
+
+
+def test_profiling_disabled(tmp_path):
+    profiler = Profiler(str(tmp_path), sample_rate=0.0)
+
+    with profiler.profile() as profile:
+        slow_function()
+
+    assert profile is None
+    assert profiler.list_profiles() == []
+
+
+def test_profiling_armed(tmp_path):
+    profiler = Profiler(str(tmp_path), sample_rate=0.0, interval=0.001)
+    profiler.arm()
+
+    with profiler.profile() as profile:
+        slow_function()
+
+    assert profiler.armed == 0
+    assert profiler.list_profiles() == [f"{profile.name}.collapsed", f"{profile.name}.json"]
+
+    with open(profiler.get_profile_path(f"{profile.name}.json")) as f:
+        result = json.load(f)
+    assert result["sections"]["slow_function"] >= 0.05
+    assert result["samples"] > 0
+    assert result["memory"]["peak"] > 100 * 1024
+
+    with open(profiler.get_profile_path(f"{profile.name}.collapsed")) as f:
+        assert "slow_function" in f.read()
+
+    assert profiler.get_profile_path("../secret") is None
+
+
+def test_profiling_rotation(tmp_path):
+    profiler = Profiler(str(tmp_path), sample_rate=1.0, max_profiles=2)
+
+    for _ in range(3):
+        with profiler.profile():
+            pass
+
+    assert len(profiler.list_profiles()) == 4
+
+
+def test_profiling_arm_validation(tmp_path):
+    profiler = Profiler(str(tmp_path))
+
+    with pytest.raises(ValueError):
+        profiler.arm(-3)
+    assert profiler.armed == 0
+
+    with pytest.raises(ValueError):
+        Profiler(str(tmp_path), max_profiles=0)
+
+
+def test_profiling_armed_for_input(tmp_path):
+    profiler = Profiler(str(tmp_path), sample_rate=0.0)
+    profiler.arm(sha256=hashlib.sha256(b"slow document").hexdigest())
+
+    with profiler.profile(b"other document") as profile:
+        pass
+    assert profile is None
+
+    with profiler.profile(b"slow document") as profile:
+        pass
+    assert profile.input_sha256 == hashlib.sha256(b"slow document").hexdigest()
+    assert profiler.armed_digests == {}
+
+
+def test_profiling_save_failure(tmp_path):
+    # The output directory cannot be created, the task must still succeed
+    (tmp_path / "file").write_text("")
+    profiler = Profiler(str(tmp_path / "file" / "profiles"), sample_rate=1.0)
+
+    with profiler.profile() as profile:
+        result = slow_function()
+
+    assert profile is not None and len(result) == 100
+
+    with pytest.raises(RuntimeError, match="task error"):
+        with profiler.profile():
+            raise RuntimeError("task error")
+
+
+def test_profiling_overlapping_peaks(tmp_path):
+    profiler = Profiler(str(tmp_path), sample_rate=1.0)
+
+    with profiler.profile() as first:
+        data = bytearray(10 * 1024 * 1024)
+        del data
+        # The second task must not erase the peak the first one reached
+        with profiler.profile() as second:
+            pass
+
+    with open(profiler.get_profile_path(f"{first.name}.json")) as f:
+        memory = json.load(f)["memory"]
+    assert memory["peak"] >= 10 * 1024 * 1024
+    assert memory["peak_reliable"] is True
+
+    with open(profiler.get_profile_path(f"{second.name}.json")) as f:
+        assert json.load(f)["memory"]["peak_reliable"] is False
@@ -0,0 +1,61 @@
+import cv2
+import numpy as np
+from model.similarity import LayoutSimilarityCache, dhash, hamming_distance
+
+
+def make_page():
+    page = np.full((400, 300, 3), 255, np.uint8)
+    cv2.rectangle(page, (20, 20), (280, 80), (0, 0, 0), -1)
+    cv2.rectangle(page, (20, 120), (150, 380), (60, 60, 60), -1)
+    return page
+
+
+res = [
+    {"type": "title", "bbox": [20, 20, 280, 80], "img": None, "res": "", "img_idx": 0, "score": 0.9},
+    {"type": "text", "bbox": [20, 120, 150, 380], "img": None, "res": "", "img_idx": 0, "score": 0.8},
+]
+
+
+def test_dhash_near_duplicate():
+    page = make_page()
+    filled_page = page.copy()
+    cv2.putText(filled_page, "John", (180, 200), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0))
+    other_page = np.full((400, 300, 3), 255, np.uint8)
+    cv2.rectangle(other_page, (150, 200), (290, 390), (0, 0, 0), -1)
+
+    assert hamming_distance(dhash(page), dhash(page)) == 0
+    assert hamming_distance(dhash(page), dhash(filled_page)) <= 8
+    assert hamming_distance(dhash(page), dhash(other_page)) > 8
+
+
+def test_cache_hit_and_miss():
+    cache = LayoutSimilarityCache(capacity=2, max_distance=8)
+    page = make_page()
+
+    cached_res, distance = cache.get(cache.key(page), page)
+    assert cached_res is None and distance is None
+
+    cache.put(cache.key(page), res)
+    cached_res, distance = cache.get(cache.key(page), page)
+    assert distance == 0
+    assert [region["bbox"] for region in cached_res] == [region["bbox"] for region in res]
+    assert cached_res[0]["img"].shape == (60, 260, 3)
+
+    # Pages of another size never reuse the layout
+    resized_page = cv2.resize(page, (200, 400))
+    cached_res, _ = cache.get(cache.key(resized_page), resized_page)
+    assert cached_res is None
+
+    assert cache.hits == 1 and cache.misses == 2
+
+
+def test_cache_eviction():
+    cache = LayoutSimilarityCache(capacity=1, max_distance=0)
+    page = make_page()
+    other_page = 255 - page
+
+    cache.put(cache.key(page), res)
+    cache.put(cache.key(other_page), res)
+
+    assert cache.get(cache.key(page), page)[0] is None
+    assert cache.get(cache.key(other_page), other_page)[0] is not None